@@ -1,19 +1,37 @@
 # app.py
 import streamlit as st
-from langgraph.graph import StateGraph, START, END
-from langchain_openai import ChatOpenAI
 from typing import TypedDict
 from pydantic import BaseModel, Field
 import json
 import os
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from email.mime.text import MIMEText
+from email.message import EmailMessage
+from email import policy
 import base64
+import hashlib
+import asyncio
+import csv
+import glob
+import io
+import re
+import sqlite3
+import threading
+import time
+
+# Google and LangChain modules are imported inside the functions that use
+# them, so the first render does not wait on them.
 
 # -------------------- CONFIG --------------------
-ALLOWED_DOMAINS = {"iands.com", "kogo.ai"}
+ALLOWED_DOMAINS = frozenset({"iands.com", "kogo.ai"})
 SCOPES = ["https://www.googleapis.com/auth/gmail.compose"]
+# 0 makes output deterministic, which is what allows generated emails to be
+# cached and reused; any other value disables the response cache.
+LLM_TEMPERATURE = 0
+BULK_BATCH_SIZE = 10  # descriptions sent per LLM call in bulk mode
+GMAIL_BATCH_LIMIT = 50  # Gmail advises at most 50 calls per batch request
+GMAIL_TIMEOUT = 60  # seconds
+GMAIL_SERVICES_PER_THREAD = 32  # cached users per worker thread
+LLM_TIMEOUT = 60  # seconds
+TOKEN_DB = "tokens/tokens.db"
 os.makedirs("tokens", exist_ok=True)
 
 # -------------------- STREAMLIT CONFIG --------------------
@@ -28,13 +46,61 @@ os.environ["OPENAI_API_KEY"] = st.secrets["openai"]["api_key"]
 google_creds = json.loads(st.secrets["google_oauth"]["credentials"])
 
 # -------------------- LLM --------------------
-llm = ChatOpenAI()
-
 class StructuredEmail(BaseModel):
     gmail_content: str = Field(description="Email body")
     gmail_subject: str = Field(description="Email subject")
 
-structured_llm = llm.with_structured_output(StructuredEmail)
+class BatchStructuredEmails(BaseModel):
+    emails: list[StructuredEmail] = Field(description="One email per description, in the same order")
+
+# Shared OpenAI connection pools, so generations reuse warm TLS connections
+# across reruns and sessions. The async client is only ever used on the
+# loop from get_event_loop, since httpx async connections are bound to the
+# loop that opened them.
+@st.cache_resource
+def get_http_client():
+    import httpx
+    return httpx.Client(
+        http2=True,
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=32)
+    )
+
+@st.cache_resource
+def get_async_http_client():
+    import httpx
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=32)
+    )
+
+@st.cache_resource
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+    return loop
+
+# Schedules coro on the shared loop and returns a concurrent.futures.Future
+def submit_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+@st.cache_resource
+def get_llm():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        temperature=LLM_TEMPERATURE,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client()
+    )
+
+@st.cache_resource
+def get_structured_llm():
+    return get_llm().with_structured_output(StructuredEmail)
+
+@st.cache_resource
+def get_batch_llm():
+    return get_llm().with_structured_output(BatchStructuredEmails)
 
 # -------------------- STATE --------------------
 class GmailState(TypedDict):
@@ -42,13 +108,12 @@ class GmailState(TypedDict):
     gmail_content: str
     gmail_subject: str
 
-# -------------------- LANGGRAPH NODE --------------------
-def create_gmail(state: GmailState):
-    prompt = f"""
-You are an expert professional email writer.
+# -------------------- PROMPT --------------------
+# Kept static and sent first so OpenAI's automatic prompt cache can reuse it;
+# the per-request description is appended afterwards as the user message.
+STATIC_RULES_PROMPT = """You are an expert professional email writer.
 
-Email description:
-{state['gmail_desc']}
+Write an email from the description given by the user.
 
 Rules:
 - Plain text only
@@ -59,28 +124,198 @@ Rules:
 
 Return structured output only.
 """
-    response = structured_llm.invoke(prompt)
+
+BATCH_RULES_PROMPT = STATIC_RULES_PROMPT + """
+The user message contains several numbered email descriptions.
+Write one email per description and return them in the same order.
+"""
+
+# Templates are parsed once per process (Streamlit re-executes module-level
+# code on every rerun); each call only substitutes the variables.
+@st.cache_resource
+def get_email_prompt():
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages([
+        ("system", STATIC_RULES_PROMPT),
+        ("human", "{gmail_desc}"),
+    ])
+
+@st.cache_resource
+def get_batch_prompt():
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages([
+        ("system", BATCH_RULES_PROMPT),
+        ("human", "Generate {count} emails:\n\n{descriptions}"),
+    ])
+
+# -------------------- LANGGRAPH NODE --------------------
+async def create_gmail(state: GmailState):
+    response = await get_structured_llm().ainvoke(
+        get_email_prompt().format_messages(gmail_desc=state["gmail_desc"])
+    )
     return {
         "gmail_content": response.gmail_content,
         "gmail_subject": response.gmail_subject,
     }
 
 # -------------------- LANGGRAPH FLOW --------------------
-graph = StateGraph(GmailState)
-graph.add_node("create_gmail", create_gmail)
-graph.add_edge(START, "create_gmail")
-graph.add_edge("create_gmail", END)
-workflow = graph.compile()
+@st.cache_resource
+def get_workflow():
+    from langgraph.graph import StateGraph, START, END
+    graph = StateGraph(GmailState)
+    graph.add_node("create_gmail", create_gmail)
+    graph.add_edge(START, "create_gmail")
+    graph.add_edge("create_gmail", END)
+    return graph.compile()
+
+# -------------------- RESPONSE CACHE --------------------
+# Generations currently running, keyed like the response cache. Only touched
+# from the get_event_loop thread, so it needs no lock.
+@st.cache_resource
+def get_inflight():
+    return {}
+
+async def cached_ainvoke(desc: str, cache: dict, refresh: bool = False) -> dict:
+    llm = get_llm()
+    key = hashlib.sha256(json.dumps(
+        {"m": llm.model_name, "t": llm.temperature, "s": STATIC_RULES_PROMPT, "p": desc},
+        sort_keys=True
+    ).encode()).hexdigest()
+
+    # Only deterministic (temperature 0) output is safe to reuse after the
+    # fact; otherwise every click must be able to produce a fresh draft.
+    # refresh skips the lookup but still stores the new result.
+    cacheable = llm.temperature == 0
+    if cacheable and not refresh and key in cache:
+        return cache[key]
+
+    # An identical request already running (e.g. a double-click) is awaited
+    # rather than paid for twice
+    inflight = get_inflight()
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(get_workflow().ainvoke({"gmail_desc": desc}))
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+
+    # shield so one caller giving up does not cancel the others
+    response = await asyncio.shield(task)
+    if cacheable:
+        cache[key] = response
+    return response
+
+# -------------------- BULK GENERATION --------------------
+async def batch_generate(descs: list) -> list:
+    numbered = "\n\n".join(f"{i}) {desc}" for i, desc in enumerate(descs, 1))
+    response = await get_batch_llm().ainvoke(
+        get_batch_prompt().format_messages(count=len(descs), descriptions=numbered)
+    )
+    if len(response.emails) != len(descs):
+        raise ValueError(f"Expected {len(descs)} emails, got {len(response.emails)}")
+    return [
+        {"gmail_content": e.gmail_content, "gmail_subject": e.gmail_subject}
+        for e in response.emails
+    ]
+
+async def bulk_generate_and_draft(user_email: str, rows: list) -> list:
+    chunks = [rows[i:i + BULK_BATCH_SIZE] for i in range(0, len(rows), BULK_BATCH_SIZE)]
+    generated = await asyncio.gather(
+        *(batch_generate([row["description"] for row in chunk]) for chunk in chunks)
+    )
+    emails = [email for chunk in generated for email in chunk]
+
+    drafts, errors = await asyncio.to_thread(
+        with_gmail_service, user_email, _create_bulk_drafts, rows, emails
+    )
+
+    return [
+        {
+            "to": ", ".join(row["to"]),
+            "subject": email["gmail_subject"],
+            "draft_id": draft["id"] if draft is not None else None,
+            "error": str(errors[i]) if i in errors else None,
+        }
+        for i, (row, email, draft) in enumerate(zip(rows, emails, drafts))
+    ]
+
+# Same (results, {index: exception}) shape as _execute_batch, per row. Each
+# message is built on its own so one row that cannot be encoded is reported
+# against that row instead of failing the whole batch.
+def _create_bulk_drafts(service, rows: list, emails: list) -> tuple:
+    results = [None] * len(rows)
+    errors = {}
+    calls, indexes = [], []
+    for i, (row, email) in enumerate(zip(rows, emails)):
+        try:
+            msg = _build_message(
+                row["to"], email["gmail_subject"], email["gmail_content"], row["cc"]
+            )
+        except Exception as e:
+            errors[i] = e
+            continue
+        calls.append(_draft_create_call(service, msg))
+        indexes.append(i)
+
+    drafts, batch_errors = _execute_batch(service, calls)
+    for i, draft in zip(indexes, drafts):
+        results[i] = draft
+    for j, e in batch_errors.items():
+        errors[indexes[j]] = e
+    return results, errors
+
+# Returns the usable rows plus a message per rejected row, so bad recipients
+# are reported before any LLM batch is paid for.
+def parse_bulk_csv(data: bytes) -> tuple:
+    rows, rejected = [], []
+    reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+    for line, record in enumerate(reader, 2):  # line 1 is the header
+        desc = (record.get("description") or "").strip()
+        if not desc:
+            continue
+        to_list, bad_to = parse_and_check(record.get("to") or "")
+        cc_list, bad_cc = parse_and_check(record.get("cc") or "")
+        if bad_to or bad_cc:
+            rejected.append(f"Line {line}: invalid email address: {', '.join(bad_to + bad_cc)}")
+        elif not to_list:
+            rejected.append(f"Line {line}: no recipient")
+        else:
+            rows.append({"description": desc, "to": to_list, "cc": cc_list or None})
+    return rows, rejected
 
 # -------------------- HELPERS --------------------
 def is_allowed_user(email: str) -> bool:
-    return email.split("@")[-1].lower() in ALLOWED_DOMAINS
+    return email.rpartition("@")[2].lower() in ALLOWED_DOMAINS
+
+# One comma-separated token, already stripped of surrounding whitespace
+_ADDR_RE = re.compile(r"[^,\s][^,]*[^,\s]|[^,\s]")
 
-def parse_emails(input_str: str) -> list:
-    return [email.strip() for email in input_str.split(",") if email.strip()]
+_WHITESPACE_RE = re.compile(r"\s")
+
+# Basic shape only: one "@", no whitespace (which would also end up as a
+# linefeed in a header), and a domain of two or more non-empty labels.
+def _is_valid_address(addr: str) -> bool:
+    local, _, domain = addr.partition("@")
+    if not local or "@" in domain or _WHITESPACE_RE.search(addr):
+        return False
+    labels = domain.split(".")
+    return len(labels) > 1 and all(labels)
+
+def parse_and_check(input_str: str) -> tuple:
+    valid, invalid = [], []
+    for match in _ADDR_RE.finditer(input_str):
+        addr = match.group(0)
+        (valid if _is_valid_address(addr) else invalid).append(addr)
+    return valid, invalid
 
 # -------------------- GMAIL AUTH --------------------
-def get_gmail_service():
+def get_gmail_service(remembered_email=None):
+    # Reuse (refreshing if needed) the token of the user this session last
+    # signed in as. Tokens of other users on disk are never tried, as that
+    # would let any visitor sign in as them.
+    if remembered_email and restore_credentials(remembered_email):
+        return remembered_email
+
+    from google_auth_oauthlib.flow import InstalledAppFlow
     flow = InstalledAppFlow.from_client_config(
         google_creds,
         SCOPES,
@@ -106,7 +341,7 @@ def get_gmail_service():
     flow.fetch_token(code=auth_code)
     creds = flow.credentials
 
-    service = build("gmail", "v1", credentials=creds)
+    service = build_gmail(creds)
 
     profile = service.users().getProfile(userId="me").execute()
     user_email = profile["emailAddress"]
@@ -114,47 +349,339 @@ def get_gmail_service():
     if not is_allowed_user(user_email):
         raise PermissionError("Access denied: unauthorized domain")
 
-    with open(f"tokens/token_{user_email}.json", "w") as f:
-        f.write(creds.to_json())
+    save_token(user_email, creds.to_json())
+
+    return user_email
+
+# -------------------- TOKEN STORE --------------------
+# All users' OAuth tokens live in one SQLite file (WAL mode) rather than one
+# JSON file per user. The connection is shared by every session and the
+# worker threads, so access is serialized with a lock.
+@st.cache_resource
+def get_token_db():
+    fresh = not os.path.exists(TOKEN_DB)
+    conn = sqlite3.connect(TOKEN_DB, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS tokens ("
+        "email TEXT PRIMARY KEY, json TEXT NOT NULL, mtime REAL NOT NULL)"
+    )
+    if fresh:
+        _import_json_tokens(conn)
+    return conn, threading.Lock()
+
+# One-time migration of the tokens/token_<email>.json files used before the
+# database, so existing users are not sent through consent again.
+def _import_json_tokens(conn):
+    with conn:
+        for path in glob.glob("tokens/token_*.json"):
+            user_email = os.path.basename(path)[len("token_"):-len(".json")]
+            with open(path) as f:
+                token_json = f.read()
+            conn.execute(
+                "INSERT OR IGNORE INTO tokens (email, json, mtime) VALUES (?, ?, ?)",
+                (user_email, token_json, os.path.getmtime(path))
+            )
 
-    return service, user_email
+def save_token(user_email: str, token_json: str):
+    conn, lock = get_token_db()
+    with lock, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO tokens (email, json, mtime) VALUES (?, ?, ?)",
+            (user_email, token_json, time.time())
+        )
+
+def load_token(user_email: str):
+    conn, lock = get_token_db()
+    with lock:
+        row = conn.execute(
+            "SELECT json FROM tokens WHERE email = ?", (user_email,)
+        ).fetchone()
+    return row[0] if row else None
+
+def token_mtime(user_email: str):
+    conn, lock = get_token_db()
+    with lock:
+        row = conn.execute(
+            "SELECT mtime FROM tokens WHERE email = ?", (user_email,)
+        ).fetchone()
+    return row[0] if row else None
+
+# Keyed on the token's mtime, so a rewritten token is picked up without
+# explicit invalidation. st.cache_resource rather than functools.lru_cache,
+# because Streamlit re-executes this module (and rebuilds any lru_cache) on
+# every rerun.
+@st.cache_resource(max_entries=32)
+def _load_credentials(user_email: str, mtime: float):
+    from google.oauth2.credentials import Credentials
+    info = json.loads(load_token(user_email))
+    return Credentials.from_authorized_user_info(info, SCOPES)
+
+# Shared transport for token refreshes so they reuse pooled TLS connections
+@st.cache_resource
+def get_auth_request():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from google.auth.transport.requests import Request
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+    return Request(session)
+
+def restore_credentials(user_email: str):
+    from google.auth.exceptions import RefreshError
+    mtime = token_mtime(user_email)
+    if mtime is None:
+        return None
+
+    creds = _load_credentials(user_email, mtime)
+    if creds.valid:
+        return creds
+    if not (creds.expired and creds.refresh_token):
+        return None
+
+    try:
+        creds.refresh(get_auth_request())
+    except RefreshError:
+        return None
+    save_token(user_email, creds.to_json())
+    return creds
+
+# googleapiclient only speaks httplib2, so HTTP/2 via httpx is not an option.
+# Giving each service its own long-lived httplib2.Http keeps the TLS
+# connection to gmail.googleapis.com open between calls instead of
+# reconnecting per request. static_discovery loads the Gmail discovery
+# document bundled with googleapiclient instead of fetching it over HTTP.
+# httplib2.Http is not thread-safe, so a service must stay on the thread
+# that built it; see load_gmail_service.
+def build_gmail(creds):
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_TIMEOUT))
+    return build("gmail", "v1", http=http, static_discovery=True)
+
+# One {user_email: (mtime, service)} map per thread. Streamlit runs every
+# rerun on a fresh script thread, so only the event loop's executor threads
+# live long enough to reuse these; Gmail calls should go through run_gmail.
+@st.cache_resource
+def _gmail_services():
+    return threading.local()
+
+# Credentials are shared process-wide, but each thread gets its own service
+# (and so its own httplib2 connection), rebuilt when the token changes and
+# evicted least-recently-used once a thread holds too many users.
+# Only use the returned service on the calling thread.
+def load_gmail_service(user_email: str):
+    mtime = token_mtime(user_email)
+    if mtime is None:
+        raise PermissionError(f"No stored Gmail token for {user_email}")
+
+    local = _gmail_services()
+    if not hasattr(local, "services"):
+        local.services = {}
+    cached = local.services.pop(user_email, None)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, build_gmail(_load_credentials(user_email, mtime)))
+        if len(local.services) >= GMAIL_SERVICES_PER_THREAD:
+            del local.services[next(iter(local.services))]
+    local.services[user_email] = cached
+    return cached[1]
+
+# Runs fn(service, ...) with a service belonging to the current thread;
+# meant as the target of asyncio.to_thread.
+def with_gmail_service(user_email: str, fn, *args, **kwargs):
+    return fn(load_gmail_service(user_email), *args, **kwargs)
+
+# Blocking wrapper for the script thread: runs fn on the event loop's
+# executor so the cached service is reused instead of rebuilt every rerun.
+def run_gmail(user_email: str, fn, *args, **kwargs):
+    return submit_async(
+        asyncio.to_thread(with_gmail_service, user_email, fn, *args, **kwargs)
+    ).result()
 
 # -------------------- GMAIL ACTIONS --------------------
-def create_gmail_draft(service, to_list, subject, body, cc_list=None):
-    msg = MIMEText(body.replace("\n", "<br>"), "html")
-    msg["to"] = ", ".join(to_list)
-    msg["subject"] = subject
+_B64_URLSAFE = bytes.maketrans(b"+/", b"-_")
+
+def _build_message(to_list, subject, body, cc_list=None) -> EmailMessage:
+    msg = EmailMessage(policy=policy.SMTP)
+    msg["To"] = ", ".join(to_list)
+    msg["Subject"] = subject
     if cc_list:
-        msg["cc"] = ", ".join(cc_list)
+        msg["Cc"] = ", ".join(cc_list)
+    msg.set_content(body.replace("\n", "<br>"), subtype="html")
+    return msg
+
+def _encode(msg: EmailMessage) -> str:
+    return base64.b64encode(bytes(msg)).translate(_B64_URLSAFE).decode("ascii")
 
-    raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-    draft = service.users().drafts().create(
+def _draft_create_call(service, msg: EmailMessage):
+    return service.users().drafts().create(
         userId="me",
-        body={"message": {"raw": raw}}
-    ).execute()
+        body={"message": {"raw": _encode(msg)}}
+    )
+
+# Sends many Gmail calls as multipart batch requests instead of one HTTP
+# round-trip each. Results come back in the order the calls were given
+# (None for a failed call), with the failures as {index: exception}, so
+# callers can keep whatever succeeded.
+def _execute_batch(service, calls: list) -> tuple:
+    results = [None] * len(calls)
+    errors = {}
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            errors[int(request_id)] = exception
+        else:
+            results[int(request_id)] = response
+
+    for start in range(0, len(calls), GMAIL_BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=on_response)
+        for i in range(start, min(start + GMAIL_BATCH_LIMIT, len(calls))):
+            batch.add(calls[i], request_id=str(i))
+        batch.execute()
+
+    return results, errors
+
+def create_gmail_draft(service, to_list, subject, body, cc_list=None):
+    msg = _build_message(to_list, subject, body, cc_list)
+    draft = _draft_create_call(service, msg).execute()
     return draft.get("id")
 
+def create_gmail_drafts(service, to_list, subject, body):
+    # One draft per recipient: the body is encoded once and only the To
+    # header changes between drafts. There is no Cc, as every CC'd address
+    # would get one copy per draft. Returns ({recipient: draft_id},
+    # {recipient: exception}). Duplicates are dropped first, since results
+    # are keyed by recipient and a second draft would be orphaned.
+    to_list = list(dict.fromkeys(to_list))
+    msg = _build_message(to_list[:1], subject, body)
+    calls = []
+    for to in to_list:
+        del msg["To"]
+        msg["To"] = to
+        calls.append(_draft_create_call(service, msg))
+
+    drafts, errors = _execute_batch(service, calls)
+    created = {to: draft["id"] for to, draft in zip(to_list, drafts) if draft is not None}
+    failed = {to_list[i]: e for i, e in errors.items()}
+    return created, failed
+
 def send_gmail_message(service, to_list, subject, body, cc_list=None, draft_id=None):
-    msg = MIMEText(body.replace("\n", "<br>"), "html")
-    msg["to"] = ", ".join(to_list)
-    msg["subject"] = subject
-    if cc_list:
-        msg["cc"] = ", ".join(cc_list)
+    # The reviewed draft is exactly what gets sent, so send it directly:
+    # one round-trip, and Gmail removes the draft as part of the send.
+    if draft_id:
+        service.users().drafts().send(userId="me", body={"id": draft_id}).execute()
+        return
 
-    raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
+    raw = _encode(_build_message(to_list, subject, body, cc_list))
     service.users().messages().send(
         userId="me",
         body={"raw": raw}
     ).execute()
 
-    if draft_id:
-        service.users().drafts().delete(userId="me", id=draft_id).execute()
+# Returns {draft_id: exception} for the drafts that could not be sent
+def send_gmail_drafts(service, draft_ids):
+    _, errors = _execute_batch(service, [
+        service.users().drafts().send(userId="me", body={"id": draft_id})
+        for draft_id in draft_ids
+    ])
+    return {draft_ids[i]: e for i, e in errors.items()}
+
+async def generate_and_draft(user_email, desc, to_list, cc_list=None, cache=None, refresh=False, per_recipient=False):
+    response = await cached_ainvoke(desc, cache if cache is not None else {}, refresh=refresh)
+    result = {
+        "response": response,
+        "to": to_list,
+        "cc": cc_list,
+        "draft_id": None,
+        "draft_ids": None,
+        "failed": {},
+    }
+
+    # googleapiclient is blocking; keep it off the event loop
+    if not per_recipient:
+        result["draft_id"] = await asyncio.to_thread(
+            with_gmail_service,
+            user_email,
+            create_gmail_draft,
+            to_list,
+            response["gmail_subject"],
+            response["gmail_content"],
+            cc_list=cc_list
+        )
+        return result
+
+    created, failed = await asyncio.to_thread(
+        with_gmail_service,
+        user_email,
+        create_gmail_drafts,
+        to_list,
+        response["gmail_subject"],
+        response["gmail_content"]
+    )
+    if not created:
+        raise next(iter(failed.values()))
+    # review and send only cover the drafts that exist
+    result["to"] = list(created)
+    result["draft_ids"] = list(created.values())
+    result["failed"] = {to: str(e) for to, e in failed.items()}
+    return result
+
+# -------------------- BACKGROUND JOBS --------------------
+# Jobs run on the shared event loop (submit_async), so they must not touch
+# st.session_state; results are copied into the session by the polling
+# fragments on the script thread.
+@st.fragment(run_every=0.5)
+def draft_progress():
+    future = st.session_state.future
+    if future is None:
+        return
+    if not future.done():
+        st.info("Generating email and creating draft...")
+        return
+
+    st.session_state.future = None
+    try:
+        result = future.result()
+    except Exception as e:
+        st.session_state.generation_error = str(e)
+    else:
+        st.session_state.generated_email = result["response"]["gmail_content"]
+        st.session_state.generated_subject = result["response"]["gmail_subject"]
+        st.session_state.generated_to = result["to"]
+        st.session_state.generated_cc = result["cc"]
+        st.session_state.draft_id = result["draft_id"]
+        st.session_state.draft_ids = result["draft_ids"]
+        if result["failed"]:
+            st.session_state.generation_error = "Could not create drafts for: " + "; ".join(
+                f"{to} ({error})" for to, error in result["failed"].items()
+            )
+        st.toast("Draft created. Please review below.")
+    st.rerun()
+
+@st.fragment(run_every=0.5)
+def bulk_progress():
+    future = st.session_state.bulk_future
+    if future is None:
+        return
+    if not future.done():
+        st.info("Generating emails and creating drafts...")
+        return
+
+    st.session_state.bulk_future = None
+    try:
+        st.session_state.bulk_results = future.result()
+    except Exception as e:
+        st.session_state.bulk_error = str(e)
+    st.rerun()
 
 # -------------------- SESSION STATE --------------------
 for key in [
-    "user_service", "user_email",
+    "user_email", "last_user_email",
     "generated_email", "generated_subject",
-    "generated_to", "generated_cc", "draft_id"
+    "generated_to", "generated_cc", "draft_id", "draft_ids",
+    "future", "generation_error",
+    "bulk_future", "bulk_results", "bulk_skipped", "bulk_error"
 ]:
     if key not in st.session_state:
         st.session_state[key] = None
@@ -162,47 +689,110 @@ for key in [
 # -------------------- AUTH UI --------------------
 st.subheader("Gmail Authentication")
 
-if not st.session_state.user_service:
-    if st.button("Authenticate Gmail"):
+if not st.session_state.user_email:
+    # After a logout the stored token is only reused when the user explicitly
+    # picks "Continue as"; any other sign-in goes through Google's consent.
+    remembered = st.session_state.last_user_email
+    continue_clicked = remembered and st.button(f"Continue as {remembered}")
+    if remembered:
+        auth_clicked = st.button("Use a different account")
+    else:
+        auth_clicked = st.button("Authenticate Gmail")
+
+    if continue_clicked or auth_clicked:
+        if auth_clicked:
+            st.session_state.last_user_email = None
         try:
-            service, email = get_gmail_service()
-            st.session_state.user_service = service
+            email = get_gmail_service(remembered if continue_clicked else None)
             st.session_state.user_email = email
+            st.session_state.last_user_email = email
             st.success(f"Logged in as {email}")
         except Exception as e:
             st.error(str(e))
 else:
     st.info(f"Logged in as {st.session_state.user_email}")
     if st.button("Logout"):
-        st.session_state.user_service = None
         st.session_state.user_email = None
         st.stop()
 
 # -------------------- EMAIL GENERATION --------------------
-if st.session_state.user_service:
+if st.session_state.user_email:
     st.subheader("Generate Email")
-
-    user_prompt = st.text_area("Email description")
-    to_email = st.text_input("To (comma-separated for multiple recipients)")
-    cc_email = st.text_input("CC (Optional, comma-separated)")
-
-    if st.button("Generate & Create Draft"):
-        response = workflow.invoke({"gmail_desc": user_prompt})
-
-        st.session_state.generated_email = response["gmail_content"]
-        st.session_state.generated_subject = response["gmail_subject"]
-        st.session_state.generated_to = parse_emails(to_email)
-        st.session_state.generated_cc = parse_emails(cc_email) if cc_email else None
-
-        st.session_state.draft_id = create_gmail_draft(
-            st.session_state.user_service,
-            st.session_state.generated_to,
-            response["gmail_subject"],
-            response["gmail_content"],
-            cc_list=st.session_state.generated_cc
-        )
-
-        st.success("Draft created. Please review below.")
+    single_tab, bulk_tab = st.tabs(["Single email", "Bulk generate"])
+
+    with single_tab:
+        user_prompt = st.text_area("Email description")
+        to_email = st.text_input("To (comma-separated for multiple recipients)")
+        cc_email = st.text_input("CC (Optional, comma-separated)")
+        per_recipient = st.checkbox("Create a separate draft for each recipient (CC not supported)")
+        refresh = st.checkbox("Regenerate instead of reusing a previous result for this description")
+
+        if st.button("Generate & Create Draft", disabled=st.session_state.future is not None):
+            to_list, bad_to = parse_and_check(to_email)
+            cc_list, bad_cc = parse_and_check(cc_email)
+            cc_list = cc_list or None
+
+            # reject bad input or a repeat click before paying for an LLM call
+            if st.session_state.future is not None:
+                st.info("A draft is already being generated")
+            elif bad_to or bad_cc:
+                st.error(f"Invalid email address: {', '.join(bad_to + bad_cc)}")
+            elif not to_list:
+                st.error("Please enter at least one recipient")
+            elif per_recipient and cc_list:
+                st.error("CC cannot be used with a separate draft per recipient")
+            else:
+                st.session_state.future = submit_async(generate_and_draft(
+                    st.session_state.user_email,
+                    user_prompt,
+                    to_list,
+                    cc_list=cc_list,
+                    cache=st.session_state.setdefault("_llm_cache", {}),
+                    refresh=refresh,
+                    per_recipient=per_recipient
+                ))
+
+        if st.session_state.generation_error:
+            st.error(st.session_state.generation_error)
+            st.session_state.generation_error = None
+
+        if st.session_state.future:
+            draft_progress()
+
+    with bulk_tab:
+        st.caption("Upload a CSV with columns: description, to, cc (cc optional).")
+        bulk_file = st.file_uploader("Descriptions CSV", type="csv")
+
+        bulk_pending = st.session_state.bulk_future is not None
+        if bulk_file and st.button("Generate Drafts", disabled=bulk_pending) and not bulk_pending:
+            rows, rejected = parse_bulk_csv(bulk_file.getvalue())
+            st.session_state.bulk_results = None
+            st.session_state.bulk_skipped = rejected
+            if not rows:
+                st.warning("No usable rows found in the CSV")
+            else:
+                st.session_state.bulk_future = submit_async(bulk_generate_and_draft(
+                    st.session_state.user_email,
+                    rows
+                ))
+
+        if st.session_state.bulk_skipped:
+            st.warning("Skipped rows:\n\n" + "\n\n".join(st.session_state.bulk_skipped))
+
+        if st.session_state.bulk_error:
+            st.error(st.session_state.bulk_error)
+            st.session_state.bulk_error = None
+
+        results = st.session_state.bulk_results
+        if results:
+            created = sum(1 for r in results if r["draft_id"])
+            st.success(f"{created} drafts created. Review them in Gmail Drafts.")
+            if created < len(results):
+                st.error(f"{len(results) - created} drafts could not be created; see the error column.")
+            st.dataframe(results)
+
+        if st.session_state.bulk_future:
+            bulk_progress()
 
 # -------------------- HUMAN APPROVAL --------------------
 if st.session_state.generated_email:
@@ -226,6 +816,7 @@ if st.session_state.generated_email:
         st.session_state.generated_to = None
         st.session_state.generated_cc = None
         st.session_state.draft_id = None
+        st.session_state.draft_ids = None
 
     with col1:
         if st.button("Cancel"):
@@ -234,13 +825,29 @@ if st.session_state.generated_email:
 
     with col2:
         if st.button("Send Email"):
-            send_gmail_message(
-                st.session_state.user_service,
-                st.session_state.generated_to,
-                st.session_state.generated_subject,
-                st.session_state.generated_email,
-                cc_list=st.session_state.generated_cc,
-                draft_id=st.session_state.draft_id
-            )
-            st.success("Email sent successfully!")
-            reset_fields()
+            user_email = st.session_state.user_email
+            if st.session_state.draft_ids:
+                failed = run_gmail(user_email, send_gmail_drafts, st.session_state.draft_ids)
+            else:
+                failed = {}
+                run_gmail(
+                    user_email,
+                    send_gmail_message,
+                    st.session_state.generated_to,
+                    st.session_state.generated_subject,
+                    st.session_state.generated_email,
+                    cc_list=st.session_state.generated_cc,
+                    draft_id=st.session_state.draft_id
+                )
+
+            if failed:
+                # keep only the unsent drafts up for review so Send can retry them
+                recipients = dict(zip(st.session_state.draft_ids, st.session_state.generated_to))
+                st.session_state.draft_ids = list(failed)
+                st.session_state.generated_to = [recipients[d] for d in failed]
+                st.error("Could not send to: " + "; ".join(
+                    f"{recipients[d]} ({error})" for d, error in failed.items()
+                ))
+            else:
+                st.success("Email sent successfully!")
+                reset_fields()